@@ -0,0 +1,284 @@
+# analytics.py
+import os
+import sys
+import json
+import atexit
+import tempfile
+import threading
+import traceback
+
+
+def log_error(message):
+    """Log d'erreur dans stderr, avec la trace de l'exception en cours"""
+    print(f"ANALYTICS: {message}\n{traceback.format_exc()}", file=sys.stderr)
+
+
+# Marqueur invalide : force un recalcul au prochain passage du thread de fond
+STALE_MARKER = "stale"
+
+
+class Analytics:
+    """
+    Compteurs agrégés de progression des joueurs.
+
+    Les compteurs sont mis à jour incrémentalement par Storage et
+    sauvegardés périodiquement par un thread de fond dans un snapshot JSON
+    non chiffré (il ne contient que des agrégats, aucun nom d'utilisateur).
+    Les lectures ne touchent jamais au fichier chiffré des utilisateurs.
+
+    Le snapshot mémorise un marqueur (mtime, taille) du fichier de données :
+    s'il ne correspond plus (crash, modification externe), les compteurs
+    sont recalculés en arrière-plan.
+    """
+
+    def __init__(self, storage, filename="data/stats.json", snapshot_interval=60):
+        self.storage = storage
+        self.filename = filename
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._stop = threading.Event()
+        self._rebuilding = threading.Event()
+        self._thread = None
+        self._rebuild_thread = None
+        # Mises à jour reçues pendant un recalcul, rejouées à la fin
+        self._pending = None
+        # Marqueur du fichier dont le recalcul a échoué
+        self._failed_marker = None
+        self._reset()
+        self._load_snapshot()
+
+    def _reset(self):
+        self.total_users = 0
+        self.progress_sum = 0
+        self.users_by_stage = {}
+        self.new_users_by_day = {}
+        self._marker = None
+
+    def _load_snapshot(self):
+        """Charge le dernier snapshot, le laisse vide s'il est absent ou illisible"""
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, "r") as f:
+                snapshot = json.load(f)
+            self.total_users = snapshot.get('total_users', 0)
+            self.progress_sum = snapshot.get('progress_sum', 0)
+            self.users_by_stage = snapshot.get('users_by_stage', {})
+            self.new_users_by_day = snapshot.get('new_users_by_day', {})
+            self._marker = snapshot.get('data_marker')
+        except Exception:
+            self._reset()
+
+    def _is_stale(self):
+        """Vérifie si les compteurs ne correspondent plus au fichier de données"""
+        with self.storage.lock:
+            marker = self.storage.data_marker()
+            with self._lock:
+                return marker != self._marker and marker != self._failed_marker
+
+    def reconcile(self, wait=False):
+        """Lance un recalcul en arrière-plan si les compteurs sont périmés"""
+        if not self._rebuilding.is_set() and self._is_stale():
+            self._start_rebuild()
+        if wait and self._rebuild_thread is not None:
+            self._rebuild_thread.join()
+
+    def _start_rebuild(self):
+        """Recalcule les compteurs depuis le stockage dans un thread de fond"""
+        if self._rebuilding.is_set():
+            return
+        self._rebuilding.set()
+        self._rebuild_thread = threading.Thread(target=self._rebuild, daemon=True)
+        self._rebuild_thread.start()
+
+    def _rebuild(self):
+        marker = None
+        try:
+            # Lecture brute sous le verrou de Storage : toute écriture
+            # postérieure de ce processus passera par _pending
+            with self.storage.lock:
+                encrypted, marker = self.storage.read_encrypted()
+                with self._lock:
+                    self._pending = []
+            users = self.storage.decrypt_data(encrypted).get('users', {})
+            by_stage = {}
+            by_day = {}
+            progress_sum = 0
+            for user in users.values():
+                stage = user.get('current_stage', 'intro')
+                by_stage[stage] = by_stage.get(stage, 0) + 1
+                progress_sum += user.get('progress', 0)
+                created = user.get('created')
+                # Les profils antérieurs n'ont pas de date de création
+                if created:
+                    by_day[created] = by_day.get(created, 0) + 1
+            with self._lock:
+                self.total_users = len(users)
+                self.progress_sum = progress_sum
+                self.users_by_stage = by_stage
+                self.new_users_by_day = by_day
+                self._marker = marker
+                for apply, args, before, after in self._pending:
+                    if apply is not None:
+                        apply(*args)
+                    self._advance_marker(before, after)
+                self._failed_marker = None
+                self._dirty = True
+        except Exception:
+            log_error("échec du recalcul des statistiques")
+            with self._lock:
+                # Pas de nouvelle tentative tant que le fichier ne change pas
+                self._failed_marker = marker
+        finally:
+            with self._lock:
+                self._pending = None
+            self._rebuilding.clear()
+
+    def _advance_marker(self, before, after):
+        # Les compteurs ne suivent le fichier que s'il n'a pas été modifié
+        # par un autre processus depuis la dernière écriture connue
+        if before == self._marker:
+            self._marker = after
+        else:
+            self._marker = STALE_MARKER
+
+    def _record(self, apply, args, before, after):
+        if apply is not None:
+            apply(*args)
+            self._dirty = True
+        if self._pending is not None:
+            self._pending.append((apply, args, before, after))
+        else:
+            self._advance_marker(before, after)
+
+    def _apply_new_user(self, stage, progress, created):
+        self.total_users += 1
+        self.progress_sum += progress
+        self.users_by_stage[stage] = self.users_by_stage.get(stage, 0) + 1
+        if created:
+            self.new_users_by_day[created] = self.new_users_by_day.get(created, 0) + 1
+
+    def _apply_progress(self, old_stage, old_progress, stage, progress):
+        self.progress_sum += progress - old_progress
+        if old_stage != stage:
+            remaining = self.users_by_stage.get(old_stage, 0) - 1
+            if remaining > 0:
+                self.users_by_stage[old_stage] = remaining
+            else:
+                self.users_by_stage.pop(old_stage, None)
+            self.users_by_stage[stage] = self.users_by_stage.get(stage, 0) + 1
+
+    # Les hooks ci-dessous sont appelés par Storage sous Storage.lock, avec
+    # les marqueurs du fichier lu (before) et du fichier écrit (after)
+
+    def record_new_user(self, user, before, after):
+        """Comptabilise un nouveau profil"""
+        args = (user.get('current_stage', 'intro'), user.get('progress', 0), user.get('created'))
+        with self._lock:
+            self._record(self._apply_new_user, args, before, after)
+
+    def record_progress(self, old_stage, old_progress, stage, progress, before, after):
+        """Comptabilise le passage d'un joueur d'une étape à une autre"""
+        with self._lock:
+            if old_stage != stage or old_progress != progress:
+                args = (old_stage, old_progress, stage, progress)
+                self._record(self._apply_progress, args, before, after)
+            else:
+                # Le fichier a été réécrit même sans changement
+                self._record(None, (), before, after)
+
+    def record_write(self, before, after):
+        """Prend en compte une écriture qui ne touche pas aux compteurs"""
+        with self._lock:
+            self._record(None, (), before, after)
+
+    def get_stats(self):
+        """Renvoie une copie des compteurs courants"""
+        with self._lock:
+            average = self.progress_sum / self.total_users if self.total_users else 0
+            return {
+                'total_users': self.total_users,
+                'average_progress': average,
+                'users_by_stage': dict(self.users_by_stage),
+                'new_users_by_day': dict(self.new_users_by_day),
+                'rebuilding': self._rebuilding.is_set(),
+            }
+
+    def snapshot(self):
+        """Écrit les compteurs sur disque s'ils ont changé"""
+        # Pas de snapshot partiel tant que le recalcul n'est pas terminé
+        if self._rebuilding.is_set():
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                'total_users': self.total_users,
+                'progress_sum': self.progress_sum,
+                'users_by_stage': dict(self.users_by_stage),
+                'new_users_by_day': dict(self.new_users_by_day),
+                'data_marker': self._marker,
+            }
+            self._dirty = False
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as f:
+            json.dump(data, f, indent=2)
+        try:
+            os.replace(f.name, self.filename)
+        except OSError:
+            os.unlink(f.name)
+            raise
+
+    def start(self):
+        """Démarre le thread de fond : réconciliation et snapshots périodiques"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _tick(self):
+        self.reconcile()
+        self.snapshot()
+
+    def _run(self):
+        while True:
+            try:
+                self._tick()
+            except Exception:
+                log_error("échec de la tâche de fond des statistiques")
+            if self._stop.wait(self.snapshot_interval):
+                return
+
+    def stop(self):
+        """Arrête le thread de fond et écrit un dernier snapshot"""
+        self._stop.set()
+        with self._lock:
+            # Sauvegarde aussi le dernier marqueur, même sans changement des compteurs
+            self._dirty = True
+        try:
+            self.snapshot()
+        except Exception:
+            log_error("échec du dernier snapshot des statistiques")
+
+
+_analytics = None
+_analytics_lock = threading.Lock()
+
+def enable_analytics(storage, **kwargs):
+    """
+    Active les statistiques dans le processus courant (serveur long).
+    Sans cet appel, get_analytics() renvoie None et Storage ne compte rien :
+    les processus CGI éphémères ne recalculent ni n'écrivent de snapshot.
+    """
+    global _analytics
+    with _analytics_lock:
+        if _analytics is None:
+            _analytics = Analytics(storage, **kwargs)
+            _analytics.start()
+            atexit.register(_analytics.stop)
+        return _analytics
+
+def get_analytics():
+    """Renvoie l'instance des statistiques, None si elles ne sont pas activées"""
+    return _analytics
@@ -8,10 +8,19 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 from storage import Storage
+from analytics import enable_analytics, get_analytics
 from game.engine import GameEngine
 
 app = JetforceApplication()
 
+# Statistiques tenues par ce processus uniquement (pas par les CGI)
+enable_analytics(Storage())
+
+# Fingerprints des certificats administrateurs, séparés par des virgules
+ADMIN_FINGERPRINTS = {
+    f.strip() for f in os.environ.get('CRYPTOQUEST_ADMINS', '').split(',') if f.strip()
+}
+
 def get_friendly_username(environ):
     """
     Récupère le username convivial depuis le mapping stocké
@@ -30,6 +39,10 @@ def is_certificate_connected(environ):
     """Vérifie si un certificat client est détecté"""
     return environ.get('TLS_CLIENT_HASH') is not None
 
+def is_admin(environ):
+    """Vérifie si le certificat client fait partie des administrateurs"""
+    return environ.get('TLS_CLIENT_HASH') in ADMIN_FINGERPRINTS
+
 @app.route("test")
 def test_route(request):
     """Route de test pour vérifier que l'application fonctionne"""
@@ -265,5 +278,43 @@ def my_certificate(request):
     
     return Response(Status.SUCCESS, "text/gemini", "\n".join(content))
 
+@app.route("admin/stats")
+def admin_stats(request):
+    """Statistiques agrégées de progression des joueurs"""
+    if not is_certificate_connected(request.environ):
+        return Response(Status.CLIENT_CERTIFICATE_REQUIRED, "Certificat administrateur requis")
+    if not is_admin(request.environ):
+        return Response(Status.CERTIFICATE_NOT_AUTHORISED, "Accès réservé aux administrateurs")
+    
+    stats = get_analytics().get_stats()
+    
+    content = [
+        "# 📊 Statistiques",
+        "",
+        f"**Joueurs :** {stats['total_users']}",
+        f"**Progression moyenne :** {stats['average_progress']:.1f}%",
+        ""
+    ]
+    
+    if stats['rebuilding']:
+        content.append("⏳ Recalcul des compteurs en cours, les chiffres sont provisoires.")
+        content.append("")
+    
+    content.append("## Joueurs par étape")
+    content.append("")
+    for stage, count in sorted(stats['users_by_stage'].items()):
+        content.append(f"* {stage} : {count}")
+    
+    content.append("")
+    content.append("## Nouveaux profils par jour")
+    content.append("")
+    for day, count in sorted(stats['new_users_by_day'].items(), reverse=True):
+        content.append(f"* {day} : {count}")
+    
+    content.append("")
+    content.append("=> / Retour à l'accueil")
+    
+    return Response(Status.SUCCESS, "text/gemini", "\n".join(content))
+
 if __name__ == "__main__":
     print("Utilisez: python3 -m jetforce --host localhost --port 1965 --tls-certfile keys/server_cert.pem --tls-keyfile keys/server_key.pem")
\ No newline at end of file
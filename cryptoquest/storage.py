@@ -1,31 +1,65 @@
 import os
 import json
+import datetime
+import threading
 from encrypt_utils import encrypt_blob, decrypt_blob
+from analytics import get_analytics
 
 class Storage:
+    # Verrou partagé : sérialise les lecture-modification-écriture du fichier
+    lock = threading.Lock()
+    
     def __init__(self, filename="data/users.json.enc"):
         self.filename = filename
         # Clé de chiffrement fixe pour la démo
         self.password = "demo_key"
     
-    def load_data(self):
-        """Charge les données chiffrées"""
+    def read_encrypted(self):
+        """Lit le contenu chiffré brut et son marqueur, (None, None) si le fichier n'existe pas"""
         if not os.path.exists(self.filename):
+            return None, None
+        with open(self.filename, "rb") as f:
+            encrypted = f.read()
+            st = os.fstat(f.fileno())
+        return encrypted, [st.st_mtime_ns, st.st_size]
+    
+    def decrypt_data(self, encrypted):
+        """Déchiffre un contenu lu par read_encrypted"""
+        if encrypted is None:
             return {}
+        decrypted = decrypt_blob(encrypted, self.password)
+        return json.loads(decrypted)
+    
+    def data_marker(self):
+        """Marqueur peu coûteux (mtime, taille) du fichier de données"""
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return None
+        return [st.st_mtime_ns, st.st_size]
+    
+    def load_data_with_marker(self):
+        """Charge les données chiffrées et le marqueur du fichier lu"""
         try:
-            with open(self.filename, "rb") as f:
-                encrypted = f.read()
-            decrypted = decrypt_blob(encrypted, self.password)
-            return json.loads(decrypted)
+            encrypted, marker = self.read_encrypted()
+            return self.decrypt_data(encrypted), marker
         except Exception:
-            return {}
+            # Pas de marqueur : les statistiques ne suivent plus le fichier
+            return {}, None
+    
+    def load_data(self):
+        """Charge les données chiffrées"""
+        return self.load_data_with_marker()[0]
     
     def save_data(self, data):
-        """Sauvegarde les données chiffrées"""
+        """Sauvegarde les données chiffrées, renvoie le marqueur du fichier écrit"""
         json_str = json.dumps(data, indent=2)
         encrypted = encrypt_blob(json_str.encode(), self.password)
         with open(self.filename, "wb") as f:
             f.write(encrypted)
+            f.flush()
+            st = os.fstat(f.fileno())
+        return [st.st_mtime_ns, st.st_size]
     
     def load_user(self, username):
         """Charge les données d'un utilisateur"""
@@ -34,34 +68,50 @@ class Storage:
     
     def ensure_user(self, username):
         """Crée un utilisateur s'il n'existe pas"""
-        data = self.load_data()
-        if 'users' not in data:
-            data['users'] = {}
-        if username not in data['users']:
-            data['users'][username] = {
-                'username': username,
-                'current_stage': 'intro',
-                'progress': 0,
-                'score': 0
-            }
-            self.save_data(data)
-        return data['users'][username]
+        with self.lock:
+            data, before = self.load_data_with_marker()
+            if 'users' not in data:
+                data['users'] = {}
+            if username not in data['users']:
+                data['users'][username] = {
+                    'username': username,
+                    'current_stage': 'intro',
+                    'progress': 0,
+                    'score': 0,
+                    'created': datetime.date.today().isoformat()
+                }
+                after = self.save_data(data)
+                analytics = get_analytics()
+                if analytics is not None:
+                    analytics.record_new_user(data['users'][username], before, after)
+            return data['users'][username]
     
     def update_user_progress(self, username, stage, progress):
         """Met à jour la progression d'un utilisateur"""
-        data = self.load_data()
-        if 'users' in data and username in data['users']:
-            data['users'][username]['current_stage'] = stage
-            data['users'][username]['progress'] = progress
-            self.save_data(data)
+        with self.lock:
+            data, before = self.load_data_with_marker()
+            if 'users' in data and username in data['users']:
+                user = data['users'][username]
+                old_stage = user.get('current_stage', 'intro')
+                old_progress = user.get('progress', 0)
+                user['current_stage'] = stage
+                user['progress'] = progress
+                after = self.save_data(data)
+                analytics = get_analytics()
+                if analytics is not None:
+                    analytics.record_progress(old_stage, old_progress, stage, progress, before, after)
     
     def save_cert_mapping(self, fingerprint, username):
         """Sauvegarde l'association fingerprint -> username"""
-        data = self.load_data()
-        if 'cert_mappings' not in data:
-            data['cert_mappings'] = {}
-        data['cert_mappings'][fingerprint] = username
-        self.save_data(data)
+        with self.lock:
+            data, before = self.load_data_with_marker()
+            if 'cert_mappings' not in data:
+                data['cert_mappings'] = {}
+            data['cert_mappings'][fingerprint] = username
+            after = self.save_data(data)
+            analytics = get_analytics()
+            if analytics is not None:
+                analytics.record_write(before, after)
     
     def get_username_from_fingerprint(self, fingerprint):
         """Récupère le username depuis le fingerprint"""
@@ -0,0 +1,196 @@
+# tests/test_analytics.py
+import os
+import sys
+import json
+import datetime
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+pytest.importorskip("cryptography")
+
+import analytics
+from analytics import Analytics
+from storage import Storage
+
+
+class BlockingStorage(Storage):
+    """Storage dont le déchiffrement du recalcul peut être suspendu"""
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.decrypt_started = threading.Event()
+        self.decrypt_release = threading.Event()
+
+    def decrypt_data(self, encrypted):
+        if threading.current_thread() is not threading.main_thread():
+            self.decrypt_started.set()
+            self.decrypt_release.wait(5)
+        return super().decrypt_data(encrypted)
+
+
+@pytest.fixture
+def stats_file(tmp_path):
+    return str(tmp_path / "stats.json")
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return Storage(str(tmp_path / "users.json.enc"))
+
+
+def enable(monkeypatch, storage, stats_file):
+    """Active les statistiques pour ce test sans démarrer le thread de fond"""
+    instance = Analytics(storage, filename=stats_file)
+    monkeypatch.setattr(analytics, '_analytics', instance)
+    return instance
+
+
+def external_write(monkeypatch, action):
+    """Écriture faite par un autre processus (CGI), sans statistiques"""
+    instance = analytics.get_analytics()
+    monkeypatch.setattr(analytics, '_analytics', None)
+    action()
+    monkeypatch.setattr(analytics, '_analytics', instance)
+
+
+def read_snapshot(stats_file):
+    with open(stats_file) as f:
+        return json.load(f)
+
+
+def test_storage_hooks_update_counters(monkeypatch, storage, stats_file):
+    stats = enable(monkeypatch, storage, stats_file)
+    today = datetime.date.today().isoformat()
+
+    storage.ensure_user('alice')
+    storage.ensure_user('bob')
+    storage.ensure_user('alice')
+    storage.update_user_progress('alice', 'chapter1', 25)
+
+    assert storage.load_user('alice')['created'] == today
+    assert stats.get_stats() == {
+        'total_users': 2,
+        'average_progress': 12.5,
+        'users_by_stage': {'intro': 1, 'chapter1': 1},
+        'new_users_by_day': {today: 2},
+        'rebuilding': False,
+    }
+
+
+def test_save_changes_data_marker(storage):
+    storage.ensure_user('alice')
+    before = storage.data_marker()
+    storage.update_user_progress('alice', 'chapter1', 25)
+    assert storage.data_marker() != before
+
+
+def test_unchanged_progress_does_not_snapshot(monkeypatch, storage, stats_file):
+    stats = enable(monkeypatch, storage, stats_file)
+    storage.ensure_user('alice')
+    storage.update_user_progress('alice', 'chapter1', 25)
+    stats.snapshot()
+    os.remove(stats_file)
+
+    storage.update_user_progress('alice', 'chapter1', 25)
+    stats.snapshot()
+
+    assert not os.path.exists(stats_file)
+    assert stats.get_stats()['users_by_stage'] == {'chapter1': 1}
+
+
+def test_snapshot_round_trip(monkeypatch, storage, stats_file):
+    stats = enable(monkeypatch, storage, stats_file)
+    storage.ensure_user('alice')
+    storage.save_cert_mapping('abc', 'alice')
+    storage.update_user_progress('alice', 'chapter1', 25)
+    stats.snapshot()
+
+    reloaded = Analytics(storage, filename=stats_file)
+    reloaded.reconcile(wait=True)
+
+    assert reloaded.get_stats() == stats.get_stats()
+    assert read_snapshot(stats_file)['data_marker'] == storage.data_marker()
+    assert sorted(os.listdir(os.path.dirname(stats_file))) == ["stats.json", "users.json.enc"]
+
+
+def test_external_write_followed_by_update_is_rebuilt(monkeypatch, storage, stats_file):
+    stats = enable(monkeypatch, storage, stats_file)
+    storage.ensure_user('alice')
+    storage.ensure_user('bob')
+
+    external_write(monkeypatch, lambda: storage.ensure_user('carol'))
+    storage.update_user_progress('alice', 'chapter1', 25)
+    assert stats.get_stats()['total_users'] == 2
+
+    stats.reconcile(wait=True)
+
+    result = stats.get_stats()
+    assert result['total_users'] == 3
+    assert result['users_by_stage'] == {'intro': 2, 'chapter1': 1}
+    assert sum(result['new_users_by_day'].values()) == 3
+
+
+def test_updates_during_rebuild_are_kept(monkeypatch, tmp_path, stats_file):
+    storage = BlockingStorage(str(tmp_path / "users.json.enc"))
+    storage.save_data({'users': {
+        f"user{i}": {'current_stage': 'intro', 'progress': 0} for i in range(50)
+    }})
+    stats = enable(monkeypatch, storage, stats_file)
+
+    thread = threading.Thread(target=stats.reconcile, kwargs={'wait': True})
+    thread.start()
+    assert storage.decrypt_started.wait(5)
+    assert stats.get_stats()['rebuilding'] is True
+
+    storage.ensure_user('newbie')
+    storage.update_user_progress('user0', 'chapter1', 25)
+    # Aucun snapshot partiel pendant le recalcul
+    stats.snapshot()
+    assert not os.path.exists(stats_file)
+
+    storage.decrypt_release.set()
+    thread.join()
+
+    result = stats.get_stats()
+    assert result['rebuilding'] is False
+    assert result['total_users'] == 51
+    assert result['users_by_stage'] == {'intro': 50, 'chapter1': 1}
+    assert result['new_users_by_day'] == {datetime.date.today().isoformat(): 1}
+
+    stats.snapshot()
+    assert read_snapshot(stats_file)['total_users'] == 51
+    assert read_snapshot(stats_file)['data_marker'] == storage.data_marker()
+
+
+def test_external_write_during_rebuild_is_not_hidden(monkeypatch, tmp_path, stats_file):
+    storage = BlockingStorage(str(tmp_path / "users.json.enc"))
+    storage.save_data({'users': {'alice': {'current_stage': 'intro', 'progress': 0}}})
+    stats = enable(monkeypatch, storage, stats_file)
+
+    thread = threading.Thread(target=stats.reconcile, kwargs={'wait': True})
+    thread.start()
+    assert storage.decrypt_started.wait(5)
+    external_write(monkeypatch, lambda: storage.ensure_user('carol'))
+    storage.decrypt_release.set()
+    thread.join()
+    assert stats.get_stats()['total_users'] == 1
+
+    stats.reconcile(wait=True)
+
+    assert stats.get_stats()['total_users'] == 2
+
+
+def test_failed_rebuild_is_logged_once(monkeypatch, storage, stats_file, capsys):
+    with open(storage.filename, "wb") as f:
+        f.write(b"corrompu" * 10)
+    stats = enable(monkeypatch, storage, stats_file)
+
+    stats.reconcile(wait=True)
+    assert "ANALYTICS" in capsys.readouterr().err
+
+    stats.reconcile(wait=True)
+    assert capsys.readouterr().err == ""
+    assert stats.get_stats()['rebuilding'] is False